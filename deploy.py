@@ -1,9 +1,20 @@
 #!/usr/bin/env python
 
-from time import sleep
-import math
+from time import sleep, time
 import os
+
+IMPORT_STARTED = (time(), os.times())
+
+import cProfile
+import math
+import pstats
 import json
+import shlex
+import socket
+import sys
+import threading
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 from subprocess import Popen, PIPE, STDOUT
 
 import click
@@ -13,12 +24,18 @@ from ordered_set import OrderedSet
 try:
     # For Python 3.0 and later
     from http.client import ResponseNotReady
+    from urllib.parse import urlparse
+    from urllib.request import urlopen
 except ImportError:
     # Fall back to Python 2
     from httplib import ResponseNotReady
+    from urlparse import urlparse
+    from urllib2 import urlopen
 
 FLEET_ENDPOINT_DEFAULT = 'http+unix://%2Fvar%2Frun%2Ffleet.sock'
 TIMEOUT = 30
+CONCURRENCY = 8
+IMPORT_TIME = (time() - IMPORT_STARTED[0], sum(os.times()[:2]) - sum(IMPORT_STARTED[1][:2]))
 
 
 class FleetConnection(object):
@@ -31,6 +48,47 @@ class FleetConnection(object):
             raise SystemExit('Unable to connect to Fleet: {0}'.format(e))
 
 
+class ThreadLocalConnection(object):
+    """ Connection per thread, the http client of a connection cannot be shared between threads """
+
+    def __init__(self, fleet_uri, factory=FleetConnection):
+        self.fleet_uri = fleet_uri
+        self.factory = factory
+        self._local = threading.local()
+        self.client  # connect the calling thread now so failures are reported up front
+
+    @property
+    def client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.factory(self.fleet_uri)
+        return client
+
+    def connect_workers(self):
+        """ Create the client of every worker thread now, instead of on first use """
+        connected = [0]
+        condition = threading.Condition()
+
+        def connect(_):
+            try:
+                self.client
+            finally:
+                # hold each worker until all are connected, so every worker gets a task
+                with condition:
+                    connected[0] += 1
+                    condition.notify_all()
+                    while connected[0] < CONCURRENCY:
+                        condition.wait()
+
+        try:
+            Plan.map_concurrently(connect, range(CONCURRENCY))
+        except Exception as e:
+            raise SystemExit(str(e))
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
 class Unit(object):
     """ Unit Instance """
 
@@ -56,12 +114,103 @@ class Unit(object):
         return "%s %s" % (self, self.state)
 
 
+class UnitTemplate(object):
+    """ Unit template, parsed once and shared by every spawn in a deployment """
+
+    def __init__(self, template):
+        self.template = template
+        self._options = None
+
+    @property
+    def options(self):
+        """ Parsed template options as an immutable tuple of (section, name, value) """
+        if self._options is None:
+            if isinstance(self.template, fleet.Unit):
+                # template loaded from fleet is already parsed
+                options = self.template.options
+            else:
+                options = fleet.Unit(from_string=self.template).options
+            self._options = tuple((o['section'], o['name'], o['value']) for o in options)
+        return self._options
+
+    def to_unit(self):
+        """ Return a new fleet Unit built from the parsed options """
+        return fleet.Unit(options=[{'section': s, 'name': n, 'value': v} for s, n, v in self.options])
+
+
+class Probe(object):
+    """ Readiness probe run against a unit once systemd reports it running
+
+    The spec is a http(s):// URL to GET, a tcp:// address to connect to or a command to run.
+    {unit}, {instance} and {ip} are substituted with the unit name, its instance and its machine IP.
+    """
+
+    def __init__(self, spec, timeout=2, interval=1, deadline=300):
+        self.spec = spec
+        self.timeout = timeout
+        self.interval = interval
+        self.deadline = deadline
+
+        # check the spec up front rather than in the middle of a stage
+        try:
+            self.uses_ip = self.target('probe@1.service', '192.0.2.1') != self.target('probe@1.service', '192.0.2.2')
+        except (KeyError, IndexError, ValueError, AttributeError) as e:
+            raise ValueError("cannot substitute %s (%s: %s), only {unit}, {instance} and {ip} are substituted "
+                             "and other braces must be doubled" % (spec, e.__class__.__name__, e))
+
+    def __str__(self):
+        return self.spec
+
+    def target(self, unit_name, ip):
+        instance = unit_name.split('@', 1)[-1].rsplit('.', 1)[0]
+        return self.spec.format(unit=unit_name, instance=instance, ip=ip)
+
+    def check(self, unit_name, ip):
+        """ Return True if the unit is ready """
+        if self.uses_ip and ip is None:
+            return False
+        target = self.target(unit_name, ip)
+        try:
+            if target.startswith(('http://', 'https://')):
+                urlopen(target, timeout=self.timeout).close()
+            elif target.startswith('tcp://'):
+                address = urlparse(target)
+                socket.create_connection((address.hostname, address.port), timeout=self.timeout).close()
+            else:
+                with open(os.devnull, 'w') as devnull:
+                    p = Popen(shlex.split(target), stdout=devnull, stderr=STDOUT)
+                    deadline = time() + self.timeout
+                    while p.poll() is None and time() < deadline:
+                        sleep(0.05)
+                    if p.poll() is None:
+                        p.kill()
+                        p.wait()
+                        return False
+                    return p.returncode == 0
+        except Exception:
+            return False
+        return True
+
+    def wait(self, unit_name, ip):
+        """ Block until the unit is ready, raise if it is not ready by the deadline """
+        if self.uses_ip and ip is None:
+            raise Exception("%s has no machine IP to probe" % unit_name)
+        deadline = time() + self.deadline
+        while self.check(unit_name, ip) is False:
+            if time() >= deadline:
+                raise Exception("%s not ready after %s seconds" % (unit_name, self.deadline))
+            click.echo('.', nl=False)
+            sleep(self.interval)
+
+
 class Step(object):
     """ Single Step in a Deployment Plan """
 
-    def __init__(self, name, action):
+    def __init__(self, name, action, template=None, payload=None):
         self.name = name
         self.action = action
+        self.template = template  # unit template overriding the plan's for spawn
+        self.payload = payload  # data overriding the plan's for external_script
 
         if action not in ('start', 'stop', 'spawn', 'destroy', 'external_script'):
             raise Exception('Invalid action')
@@ -76,75 +225,185 @@ class Step(object):
 class Plan(object):
     """ Collection of deployment steps and execution methods """
 
-    def __init__(self, fleet_client, service_name, full_service_name, unit_template):
+    labels = {
+        'spawn': 'Spawning',
+        'start': 'Starting',
+        'stop': 'Stopping',
+        'destroy': 'Destroying',
+    }
+
+    pool = None  # worker threads shared by all plans, so their connections are reused
+
+    def __init__(self, fleet_client, service_name, full_service_name, unit_template, probe=None):
         self.fleet = fleet_client
         self.service_name = service_name
         self.full_service_name = full_service_name
         self.unit_template = unit_template
+        self.probe = probe
         self.steps = OrderedSet()
+        self.inverse_steps = list()
+        self._lock = threading.Lock()
 
     def __str__(self):
         return "<Plan Object (%s steps)>" % len(self.steps)
 
     def run(self):
         click.echo("==> Executing")
-        for i in range(0, len(self.steps)):
-            self.execute(i)
+        i = 0
+        while i < len(self.steps):
+            # consecutive steps with the same unit action are run together
+            action = self.steps[i].action
+            group = list()
+            if action != 'external_script':
+                for step in self.steps[i:]:
+                    if step.action != action:
+                        break
+                    group.append(step)
+            if group:
+                self.execute_concurrently(group)
+                i += len(group)
+            else:
+                self.execute(i)
+                i += 1
+
+    def get_states(self, names):
+        """ Return current state of the named units keyed by name
+
+        Fleet is queried per unit so the payload does not grow with the rest of the cluster.
+        """
+        states = dict()
+
+        def fetch(name):
+            for unit in self.fleet.list_unit_states(unit_name=name):
+                states[unit.name] = unit
+
+        self.map_concurrently(fetch, names)
+        return states
+
+    def get_ips(self, names):
+        """ Return the machine IP of each of the units keyed by name """
+        if not names:
+            return dict()
+        machines = dict()
+        for machine in self.fleet.list_machines():
+            machines[machine.id] = machine.primaryIP
+        ips = dict()
+        for name, unit in self.get_states(names).items():
+            ips[name] = machines.get(unit.machineID)
+        return ips
+
+    def record_inverse(self, step):
+        """ Record the step(s) undoing a submitted step """
+        with self._lock:
+            if step.action == 'stop':
+                self.inverse_steps.append(Step(step.name, 'start'))
+            if step.action == 'start':
+                # unit is running again, nothing left to restart
+                self.inverse_steps = [s for s in self.inverse_steps
+                                      if not (s.action == 'start' and s.name == step.name)]
+            if step.action == 'spawn':
+                self.inverse_steps.append(Step(step.name, 'destroy'))
+            if step.action == 'destroy':
+                # unit is gone, spawn it again instead of restarting it
+                self.inverse_steps = [s for s in self.inverse_steps
+                                      if not (s.action == 'start' and s.name == step.name)]
+                self.inverse_steps.append(Step(step.name, 'spawn', template=step.template))
+            if step.action == 'external_script':
+                self.inverse_steps.append(Step(step.name, 'external_script', payload=step.payload))
+
+    @classmethod
+    def map_concurrently(cls, func, items):
+        if not items:
+            return
+        if Plan.pool is None:
+            Plan.pool = ThreadPool(CONCURRENCY)
+        func = Profiler.profiled(func)
+
+        def call(item):
+            # pool workers only pass on Exception, anything else would leave map() waiting forever
+            try:
+                return func(item)
+            except Exception:
+                raise
+            except BaseException as e:
+                raise Exception(str(e) or e.__class__.__name__)
+
+        Plan.pool.map(call, items)
+
+    def execute_concurrently(self, steps):
+        """ Submit spawn, start, stop and destroy steps at once and wait until they have all settled """
+        output = list()
+        for action in ('spawn', 'start', 'stop', 'destroy'):
+            names = [step.name for step in steps if step.action == action]
+            if names:
+                output.append("%s %s" % (self.labels[action], ', '.join(names)))
+        click.echo("%s..." % '; '.join(output), nl=False)
+
+        def submit(step):
+            if step.action == 'spawn':
+                template = step.template or self.unit_template
+                self.fleet.create_unit(step.name, template.to_unit())
+                self.record_inverse(step)
+            if step.action == 'start':
+                self.fleet.set_unit_desired_state(step.name, 'launched')
+            if step.action == 'stop':
+                self.fleet.set_unit_desired_state(step.name, 'inactive')
+                self.record_inverse(step)
+            if step.action == 'destroy':
+                self.fleet.set_unit_desired_state(step.name, 'inactive')
+                # stopped until destroyed, restart it if anything fails before then
+                self.record_inverse(Step(step.name, 'stop'))
+
+        def settled():
+            states = self.get_states([step.name for step in steps])
+            for step in steps:
+                running = step.name in states and states[step.name].systemdSubState == 'running'
+                if running is (step.action in ('stop', 'destroy')):
+                    return False
+            return True
+
+        self.map_concurrently(submit, steps)
+        while settled() is False:
+            click.echo('.', nl=False)
+            sleep(1)
+
+        if self.probe is not None:
+            ready = [step.name for step in steps if step.action in ('spawn', 'start')]
+            ips = self.get_ips(ready)
+            self.map_concurrently(lambda name: self.probe.wait(name, ips.get(name)), ready)
+
+        def destroy(step):
+            # keep the unit definition so the destroy can be undone
+            inverse = Step(step.name, 'destroy', template=UnitTemplate(self.fleet.get_unit(step.name)))
+            self.fleet.destroy_unit(step.name)
+            self.record_inverse(inverse)
+
+        self.map_concurrently(destroy, [step for step in steps if step.action == 'destroy'])
+        for step in steps:
+            if step.action == 'start':
+                self.record_inverse(step)
+        click.echo("Done.")
 
     def execute(self, step_number):
 
         step = self.steps[step_number]
 
-        def get_state(step):
-            """ Return current state """
-            for unit in self.fleet.list_unit_states():
-                if unit.name == step.name:
-                    return unit.systemdSubState
-
-        def is_running():
-            return get_state(step) == 'running'
-
         # run appropriate action
-        if step.action == 'stop':
-            click.echo("Stopping %s..." % step.name, nl=False)
-            self.fleet.set_unit_desired_state(step.name, 'inactive')
-            while is_running() is True:
-                click.echo('.', nl=False)
-                sleep(1)
-            click.echo("Done.")
-
-        if step.action == 'start':
-            click.echo("Starting %s..." % step.name, nl=False)
-            self.fleet.set_unit_desired_state(step.name, 'launched')
-            while is_running() is False:
-                click.echo('.', nl=False)
-                sleep(1)
-            click.echo("Done.")
-
-        if step.action == 'spawn':
-            click.echo("Spawning %s..." % step.name, nl=False)
-            self.fleet.create_unit(step.name, fleet.Unit(from_string=self.unit_template))
-            while is_running() is False:
-                click.echo('.', nl=False)
-                sleep(1)
-            click.echo("Done.")
-
-        if step.action == 'destroy':
-            click.echo("Destroying %s..." % step.name, nl=False)
-            self.fleet.set_unit_desired_state(step.name, 'inactive')
-            while is_running() is True:
-                click.echo('.', nl=False)
-                sleep(1)
-            self.fleet.destroy_unit(step.name)
-            click.echo("Done.")
+        if step.action in ('start', 'stop', 'spawn', 'destroy'):
+            self.execute_concurrently([step])
 
         if step.action == 'external_script':
             click.echo("Executing %s with data: " % step.name, nl=False)
-            data = self.get_external_script_payload()
+            data = step.payload or self.get_external_script_payload()
             click.echo(data)
             result = self.execute_external_script(step.name, data)
             click.echo("Result %s" % result)
 
+            # the inverse announces the units the other way round
+            payload = json.loads(data)
+            payload['units_added'], payload['units_removed'] = payload['units_removed'], payload['units_added']
+            self.record_inverse(Step(step.name, 'external_script', payload=json.dumps(payload)))
+
     @staticmethod
     def execute_external_script(script, data):
         # run the script as a subprocess:
@@ -172,15 +431,79 @@ class Plan(object):
         return json.dumps(data)
 
 
+class RollbackPlan(Plan):
+    """ Inverse of executed plans, replayed concurrently with the old capacity restored first """
+
+    def __str__(self):
+        return "<Rollback Plan Object (%s steps)>" % len(self.steps)
+
+    @classmethod
+    def from_plans(cls, fleet_client, plans):
+        """ Build the rollback of plans, undoing the most recent steps first """
+        plan = cls(fleet_client, plans[0].service_name, plans[0].full_service_name, None, plans[0].probe)
+        for p in reversed(plans):
+            for step in reversed(p.inverse_steps):
+                plan.steps.append(step)
+        return plan
+
+    @classmethod
+    def load(cls, fleet_client, data, probe=None):
+        """ Build the rollback from the output of dump() """
+        plan = cls(fleet_client, data['service_name'], data['deployment_name'], None, probe)
+        for s in data['steps']:
+            template = None
+            if s['options'] is not None:
+                template = UnitTemplate(fleet.Unit(options=[{'section': section, 'name': name, 'value': value}
+                                                            for section, name, value in s['options']]))
+            plan.steps.append(Step(s['name'], s['action'], template=template, payload=s['payload']))
+        return plan
+
+    def dump(self):
+        """ Return a JSON serializable representation of the rollback """
+        steps = list()
+        for step in self.steps:
+            steps.append({
+                'name': step.name,
+                'action': step.action,
+                'options': [list(o) for o in step.template.options] if step.template is not None else None,
+                'payload': step.payload,
+            })
+        return {
+            'service_name': self.service_name,
+            'deployment_name': self.full_service_name,
+            'steps': steps,
+        }
+
+    def describe(self):
+        output = list()
+        output.append("*** Rollback Plan ***")
+        for idx, step in enumerate(self.steps, 1):
+            output.append("Step %s: %s" % (idx, step))
+        return output
+
+    def run(self):
+        click.echo("==> Rolling back")
+        restore = [step for step in self.steps if step.action in ('spawn', 'start')]
+        remove = [step for step in self.steps if step.action in ('stop', 'destroy')]
+        if restore:
+            self.execute_concurrently(restore)
+        for i in range(0, len(self.steps)):
+            if self.steps[i].action == 'external_script':
+                self.execute(i)
+        if remove:
+            self.execute_concurrently(remove)
+
+
 class BaseDeployment(object):
 
     name = 'Base Deployment'
 
-    def __init__(self, fleet_client, service_name, tag, unit_file=None):
+    def __init__(self, fleet_client, service_name, tag, unit_file=None, probe=None):
 
         self.fleet = fleet_client
         self.service_name = service_name
         self.tag = tag
+        self.probe = probe
 
         self.plans = list()
         self.units = OrderedSet()
@@ -189,9 +512,10 @@ class BaseDeployment(object):
 
         if unit_file is None:
             # load service template from fleet
-            self.unit_template = self.fleet.get_unit("%s@.service" % self.service_name)
+            self.unit_template = UnitTemplate(self.fleet.get_unit("%s@.service" % self.service_name))
         else:
-            self.unit_template = unit_file.read()
+            self.unit_template = UnitTemplate(unit_file.read())
+        self.unit_template.options  # parse once, an invalid template fails before any plan is made
 
     def __str__(self):
         return "<Base Deployment Object: (%s plans) (%s units)>" % (len(self.plans), len(self.units))
@@ -218,6 +542,7 @@ class BaseDeployment(object):
 
         # Load unit state from cluster, set desired instances.
         # find relevant units that exist in the cluster
+        # fleet's Units.List has no name filter and no guaranteed order, so every page has to be read
         for u in self.fleet.list_units():
             if u['name'].startswith(self.service_name + '-'):
                 if u['name'] != "%s@.service" % self.service_name:  # Exclude service templates
@@ -264,7 +589,7 @@ class BaseDeployment(object):
     def create_plans(self):
         i = 0
         while i < self.current_unit_count:
-            plan = Plan(self.fleet, self.service_name, self.full_service_name, self.unit_template)
+            plan = Plan(self.fleet, self.service_name, self.full_service_name, self.unit_template, self.probe)
             from_idx = i
             to_idx = i + self.chunking_count
             if to_idx > self.current_unit_count:
@@ -309,9 +634,22 @@ class BaseDeployment(object):
                 step_idx += 1
         return output
 
-    def run_plans(self):
-        for plan in self.plans:
-            plan.run()
+    def run_plans(self, rollback_on_failure=False, rollback_file=None):
+        executed = list()
+        try:
+            for plan in self.plans:
+                executed.append(plan)
+                plan.run()
+        except (Exception, KeyboardInterrupt):
+            if rollback_on_failure:
+                click.echo("Failed.")
+                RollbackPlan.from_plans(self.fleet, executed).run()
+                executed = list()
+            raise
+        finally:
+            if rollback_file is not None and executed:
+                with open(rollback_file, 'w') as f:
+                    json.dump(RollbackPlan.from_plans(self.fleet, executed).dump(), f)
         click.echo("Finished.")
 
 
@@ -363,7 +701,7 @@ class AtomicRollingDeployment(BaseDeployment):
 
         i = 0
         while i < self.current_unit_count:
-            plan = Plan(self.fleet, self.service_name, self.full_service_name, self.unit_template)
+            plan = Plan(self.fleet, self.service_name, self.full_service_name, self.unit_template, self.probe)
             from_idx = i
             to_idx = i + self.chunking_count
             if to_idx > self.current_unit_count:
@@ -374,9 +712,101 @@ class AtomicRollingDeployment(BaseDeployment):
             self.plans.append(plan)
 
 
+def cpu_time():
+    """ User and system CPU time of the process, including all threads """
+    t = os.times()
+    return t[0] + t[1]
+
+
+class Profiler(object):
+    """ Per phase wall clock and CPU time of a run, with the phases also recorded by cProfile
+
+    Before Python 3.12 cProfile only sees the thread it is enabled in, so work mapped onto the worker
+    threads during a phase is profiled in the workers and merged into the stats. From 3.12 the phase
+    profile sees every thread, and a second profiler cannot be enabled alongside it.
+    """
+
+    phases = ('import', 'connect', 'load', 'plan', 'describe', 'delay', 'run')
+    current = None  # profiler of the phase being run
+
+    def __init__(self, enabled=False, exclude=()):
+        self.enabled = enabled
+        self.exclude = exclude
+        self.timings = list()
+        self.profile = cProfile.Profile() if enabled else None
+        self.worker_profiles = list()
+
+    @classmethod
+    def profiled(cls, func):
+        """ Wrap func to be profiled in the thread it runs in, while a phase is being profiled """
+        profiler = cls.current
+        if profiler is None or sys.version_info >= (3, 12):
+            return func
+
+        def wrapper(*args):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except Exception:
+                # profiling must never change the outcome of the work
+                return func(*args)
+            try:
+                return func(*args)
+            finally:
+                profile.disable()
+                profiler.worker_profiles.append(profile)
+        return wrapper
+
+    def add(self, name, wall, cpu):
+        """ Record a phase timed elsewhere """
+        if self.enabled and name not in self.exclude:
+            self.timings.append((name, wall, cpu))
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled or name in self.exclude:
+            yield
+            return
+        wall, cpu = time(), cpu_time()
+        try:
+            self.profile.enable()
+            profiling = True
+        except Exception:
+            # another profiler is active, still time the phase
+            profiling = False
+        Profiler.current = self if profiling else None
+        try:
+            yield
+        finally:
+            if profiling:
+                self.profile.disable()
+            Profiler.current = None
+            self.add(name, time() - wall, cpu_time() - cpu)
+
+    def dump(self, path):
+        """ Write the cProfile stats, readable with pstats. Return False if nothing was profiled """
+        profiles = [p for p in [self.profile] + self.worker_profiles if p.getstats()]
+        if not profiles:
+            return False
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(path)
+        return True
+
+    def summary(self):
+        output = list()
+        output.append("==> Profile")
+        output.append("%-10s %10s %10s" % ('Phase', 'Wall (s)', 'CPU (s)'))
+        for name, wall, cpu in self.timings:
+            output.append("%-10s %10.3f %10.3f" % (name, wall, cpu))
+        output.append("%-10s %10.3f %10.3f" % ('total', sum(t[1] for t in self.timings), sum(t[2] for t in self.timings)))
+        return output
+
+
 @click.command()
 @click.option('--fleet-endpoint', default=FLEET_ENDPOINT_DEFAULT, help="Fleet URI / socket", envvar='FLEETCTL_ENDPOINT')
-@click.option('--name', required=True, help="Name of service to deploy")
+@click.option('--name', help="Name of service to deploy")
 @click.option('--tag', required=False, type=click.STRING, help="Tag label. eg Git tag")
 @click.option('--method', default='stopstart', type=click.Choice(['stopstart', 'rolling', 'atomic']), help="Deployment method")
 @click.option('--instances', type=click.INT, help="Desired number of instances")
@@ -385,10 +815,31 @@ class AtomicRollingDeployment(BaseDeployment):
 @click.option('--chunking', type=click.INT, help="Number of containers to act on each pass. Eg 2")
 @click.option('--chunking-percent', type=click.INT, help="Percentage of containers to act on each pass. Eg 50")
 @click.option('--delay', default=5, type=click.INT, help="Startup delay")
-def main(fleet_endpoint, name, tag, method, instances, unit_file, atomic_handler, chunking, chunking_percent, delay):
+@click.option('--probe', help="Readiness probe: http(s):// or tcp:// URL, or command. {unit}, {instance} and {ip} are substituted")
+@click.option('--probe-timeout', default=2, type=click.FLOAT, help="Readiness probe timeout in seconds")
+@click.option('--probe-interval', default=1, type=click.FLOAT, help="Seconds between readiness probe attempts")
+@click.option('--probe-deadline', default=300, type=click.FLOAT, help="Seconds for a unit to become ready before failing")
+@click.option('--rollback-on-failure', is_flag=True, help="Roll back executed stages if the deployment fails")
+@click.option('--rollback-file', type=click.Path(dir_okay=False, writable=True), help="File the rollback steps are saved to, or read from with --rollback")
+@click.option('--rollback', is_flag=True, help="Roll back the deployment saved in --rollback-file instead of deploying")
+@click.option('--profile', type=click.Path(dir_okay=False, writable=True), help="Write pstats profile to file and print a per phase summary")
+@click.option('--profile-exclude', multiple=True, type=click.Choice(Profiler.phases), help="Phase to leave out of the profile. Eg delay")
+def main(fleet_endpoint, name, tag, method, instances, unit_file, atomic_handler, chunking, chunking_percent, delay,
+         probe, probe_timeout, probe_interval, probe_deadline, rollback_on_failure, rollback_file, rollback, profile,
+         profile_exclude):
     """Main function"""
 
     # Validation
+    if name is None and not rollback:
+        raise click.UsageError('Missing option "--name".')
+
+    # rollback validation
+    if rollback and rollback_file is None:
+        raise click.UsageError('--rollback requires --rollback-file')
+
+    if rollback and rollback_on_failure:
+        raise click.UsageError('--rollback-on-failure is not valid with --rollback')
+
     if chunking is not None and chunking_percent is not None:
         raise click.UsageError('Cannot use --chunking and --chunking-percent together.')
 
@@ -420,27 +871,61 @@ def main(fleet_endpoint, name, tag, method, instances, unit_file, atomic_handler
         'rolling':  RollingDeployment,
         'atomic': AtomicRollingDeployment,
     }
-    connection = FleetConnection(fleet_endpoint)
-    method_obj = deployment_map[method]
-    if method == 'atomic':
-        deployment = method_obj(atomic_handler, connection, name, tag, unit_file)
-    else:
-        deployment = method_obj(connection, name, tag, unit_file)
-    deployment.load(instances)
-
-    deployment.update_chunking(chunking, chunking_percent)
-    deployment.create_plans()
-    for line in deployment.describe_plans():
-        click.echo(line)  # Print planned execution
-
-    # Give chance to abort
-    click.echo("==> Run")
-    click.echo('Starting in %s seconds...' % delay, nl=False)
-    for i in range(0, delay):
-        sleep(1)
-        click.echo(' %s' % (delay-i), nl=False)
-    click.echo('... Starting.')
-    deployment.run_plans()
+    if probe is not None:
+        try:
+            probe = Probe(probe, probe_timeout, probe_interval, probe_deadline)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint='--probe')
+    profiler = Profiler(profile is not None, profile_exclude)
+    profiler.add('import', *IMPORT_TIME)
+    try:
+        with profiler.phase('connect'):
+            connection = ThreadLocalConnection(fleet_endpoint)
+            connection.connect_workers()
+        method_obj = deployment_map[method]
+        with profiler.phase('load'):
+            if rollback:
+                with open(rollback_file) as f:
+                    rollback_plan = RollbackPlan.load(connection, json.load(f), probe)
+            else:
+                if method == 'atomic':
+                    deployment = method_obj(atomic_handler, connection, name, tag, unit_file, probe)
+                else:
+                    deployment = method_obj(connection, name, tag, unit_file, probe)
+                deployment.load(instances)
+
+        with profiler.phase('plan'):
+            if not rollback:
+                deployment.update_chunking(chunking, chunking_percent)
+                deployment.create_plans()
+        with profiler.phase('describe'):
+            lines = rollback_plan.describe() if rollback else deployment.describe_plans()
+            for line in lines:
+                click.echo(line)  # Print planned execution
+
+        # Give chance to abort
+        with profiler.phase('delay'):
+            click.echo("==> Run")
+            click.echo('Starting in %s seconds...' % delay, nl=False)
+            for i in range(0, delay):
+                sleep(1)
+                click.echo(' %s' % (delay-i), nl=False)
+            click.echo('... Starting.')
+        with profiler.phase('run'):
+            if rollback:
+                rollback_plan.run()
+                click.echo("Finished.")
+            else:
+                deployment.run_plans(rollback_on_failure, rollback_file)
+    finally:
+        if profile is not None:
+            for line in profiler.summary():
+                click.echo(line, err=True)
+            if profiler.dump(profile):
+                click.echo("Profile written to %s" % profile, err=True)
+            else:
+                click.echo("No phases profiled, %s not written" % profile, err=True)
+
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
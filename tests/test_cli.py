@@ -1,9 +1,38 @@
 from subprocess import call
+import json
 import os
+import shutil
+import tempfile
+
+from click.testing import CliRunner
+
+import deploy
 
 BIN = os.path.abspath(os.path.join(os.path.split(__file__)[0], '..', 'deploy.py'))
 
 
+class FakeState(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.systemdSubState = 'running'
+
+
+class FakeFleetClient(object):
+
+    def __init__(self, fleet_uri):
+        self.running = set()
+
+    def connect_workers(self):
+        pass
+
+    def set_unit_desired_state(self, name, state):
+        self.running.add(name)
+
+    def list_unit_states(self, unit_name=None):
+        return [FakeState(name) for name in self.running if name == unit_name]
+
+
 def test_no_args():
     exit_code = call([BIN])
     assert exit_code == 2
@@ -11,4 +40,35 @@ def test_no_args():
 
 def test_help():
     exit_code = call([BIN, '--help'])
-    assert exit_code == 0
\ No newline at end of file
+    assert exit_code == 0
+
+
+def test_rollback_requires_file():
+    result = CliRunner().invoke(deploy.main, ['--rollback'])
+    assert result.exit_code == 2
+    assert '--rollback requires --rollback-file' in result.output
+
+
+def test_invalid_probe():
+    result = CliRunner().invoke(deploy.main, ['--name', 'foo', '--probe', "awk '{print $1}'"])
+    assert result.exit_code == 2
+    assert 'Invalid value for --probe' in result.output
+
+
+def test_rollback():
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, 'rollback.json')
+    with open(path, 'w') as f:
+        json.dump({'service_name': 'foo', 'deployment_name': 'foo-new', 'steps': [
+            {'name': 'foo-old@1.service', 'action': 'start', 'options': None, 'payload': None},
+        ]}, f)
+    connection = deploy.ThreadLocalConnection
+    deploy.ThreadLocalConnection = FakeFleetClient
+    try:
+        result = CliRunner().invoke(deploy.main, ['--rollback', '--rollback-file', path, '--delay', '0'])
+    finally:
+        deploy.ThreadLocalConnection = connection
+        shutil.rmtree(tmp)
+    assert result.exit_code == 0, result.output
+    assert 'Step 1: start foo-old@1.service' in result.output
+    assert 'Starting foo-old@1.service...Done.' in result.output
@@ -1,3 +1,4 @@
+import io
 import unittest
 
 from deploy import RollingDeployment, SimpleDeployment, AtomicRollingDeployment
@@ -17,24 +18,32 @@ class FakeUnit(object):
 class FakeFleetClient(object):
 
     test_data = [
-        {'name': 'foo@.service', 'currentState': 'inactive', 'systemdSubState': 'inactive'},
+        {'name': 'bar-tag@1.service', 'currentState': 'launched', 'systemdSubState': 'running'},
         {'name': 'foo-oldtag@1.service', 'currentState': 'launched', 'systemdSubState': 'running'},
         {'name': 'foo-oldtag@2.service', 'currentState': 'launched', 'systemdSubState': 'running'},
+        {'name': 'foo@.service', 'currentState': 'inactive', 'systemdSubState': 'inactive'},
+        {'name': 'zap-tag@1.service', 'currentState': 'launched', 'systemdSubState': 'running'},
     ]
 
+    def __init__(self):
+        self.listed = list()
+
     def list_units(self):
-        return self.test_data
+        for u in self.test_data:
+            self.listed.append(u['name'])
+            yield u
 
     def get_unit(self, unit_name):
-        return "Unit file of %s" % unit_name
+        return "[Unit]\nDescription=Unit file of %s\n" % unit_name
 
     def set_unit_desired_state(self, unit, state):
         print("Fleet set: %s -> %s" % (unit, state))
 
-    def list_unit_states(self):
+    def list_unit_states(self, unit_name=None):
         states = list()
         for u in self.test_data:
-            states.append(FakeUnit(u['name'], u['currentState'], u['systemdSubState']))
+            if unit_name is None or u['name'] == unit_name:
+                states.append(FakeUnit(u['name'], u['currentState'], u['systemdSubState']))
         return states
 
 
@@ -79,6 +88,16 @@ class TestRollingDeployment(unittest.TestCase):
         # Todo we can't actually test the running, ... yet
         #self.deployment.run_plans()
 
+    def test_invalid_unit_file(self):
+        with self.assertRaises(ValueError):
+            RollingDeployment(FakeFleetClient(), 'foo', 'newtag', io.StringIO(u'not a unit file'))
+
+    def test_load_unordered(self):
+        self.deployment.fleet.test_data = list(reversed(FakeFleetClient.test_data))
+        self.deployment.load(2)
+        self.assertEqual([u.name for u in self.deployment.units], ['foo-oldtag@2.service', 'foo-oldtag@1.service'])
+        self.assertEqual(len(self.deployment.fleet.listed), len(FakeFleetClient.test_data))
+
 
 class TestSimpleDeployment(unittest.TestCase):
 
@@ -1,6 +1,8 @@
 import unittest
 
-from deploy import FleetConnection, FLEET_ENDPOINT_DEFAULT
+import threading
+
+from deploy import CONCURRENCY, FleetConnection, ThreadLocalConnection, FLEET_ENDPOINT_DEFAULT
 
 
 class TestFleetConnection(unittest.TestCase):
@@ -9,5 +11,34 @@ class TestFleetConnection(unittest.TestCase):
         with self.assertRaises(SystemExit):
             c = FleetConnection(fleet_uri=FLEET_ENDPOINT_DEFAULT)
 
+    def test_thread_local_failed_connection_handling(self):
+        with self.assertRaises(SystemExit):
+            c = ThreadLocalConnection(FLEET_ENDPOINT_DEFAULT)
+
+    def test_connect_workers(self):
+        threads = list()
+
+        def factory(fleet_uri):
+            threads.append(threading.current_thread())
+            return object()
+
+        c = ThreadLocalConnection('http://fleet', factory)
+        c.connect_workers()
+        # the calling thread and every worker
+        self.assertEqual(len(set(threads)), CONCURRENCY + 1)
+
+    def test_connect_workers_failure(self):
+        clients = list()
+
+        def factory(fleet_uri):
+            if clients:
+                raise SystemExit('Unable to connect to Fleet')
+            clients.append(object())
+            return clients[-1]
+
+        c = ThreadLocalConnection('http://fleet', factory)
+        with self.assertRaises(SystemExit):
+            c.connect_workers()
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
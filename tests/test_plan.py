@@ -1,6 +1,78 @@
+import json
+import threading
 import unittest
 
-from deploy import Plan, Step
+import fleet.v1 as fleet
+
+from deploy import Plan, Probe, RollbackPlan, Step, ThreadLocalConnection, UnitTemplate
+
+
+class FakeState(object):
+
+    def __init__(self, name, systemdSubState):
+        self.name = name
+        self.systemdSubState = systemdSubState
+        self.machineID = 'm1'
+
+
+class FakeMachine(object):
+
+    id = 'm1'
+    primaryIP = '10.0.0.1'
+
+
+class ThreadBoundFleetClient(object):
+    """ Fails when used from another thread than its own, as a shared http connection would """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.thread = threading.current_thread()
+
+    def __getattr__(self, name):
+        if threading.current_thread() is not self.thread:
+            raise AssertionError('Fleet client shared between threads')
+        return getattr(self.backend, name)
+
+
+class FakeProbe(Probe):
+
+    def __init__(self):
+        super(FakeProbe, self).__init__('{unit} {ip}', interval=0)
+        self.checks = list()
+
+    def check(self, unit_name, ip):
+        self.checks.append(self.target(unit_name, ip))
+        # ready on the second attempt
+        return self.checks.count(self.target(unit_name, ip)) > 1
+
+
+class FakeFleetClient(object):
+
+    def __init__(self, running=()):
+        self.created = list()
+        self.running = set(running)
+
+    def create_unit(self, name, unit):
+        self.created.append(name)
+        self.running.add(name)
+
+    def get_unit(self, name):
+        return fleet.Unit(from_string='[Service]\nExecStart=/bin/%s\n' % name)
+
+    def set_unit_desired_state(self, name, state):
+        if state == 'launched':
+            self.running.add(name)
+        else:
+            self.running.discard(name)
+
+    def destroy_unit(self, name):
+        self.running.discard(name)
+
+    def list_unit_states(self, unit_name=None):
+        return [FakeState(name, 'running') for name in self.running if unit_name in (None, name)]
+
+    def list_machines(self):
+        return [FakeMachine()]
 
 
 class TestPlan(unittest.TestCase):
@@ -26,5 +98,154 @@ class TestPlan(unittest.TestCase):
         self.plan.steps.append(Step('./tests/atomic.sh', 'external_script'))
         self.plan.execute(2)
 
+    def test_bulk_spawn(self):
+        fleet_client = FakeFleetClient()
+        template = UnitTemplate('[Service]\nExecStart=/bin/true\n')
+        plan = Plan(fleet_client, 'test-service', 'test-service-abc123', template)
+        plan.steps.append(Step('foo@1.service', 'spawn'))
+        plan.steps.append(Step('foo@2.service', 'spawn'))
+        plan.steps.append(Step('foo@3.service', 'spawn'))
+        plan.run()
+        self.assertEqual(sorted(fleet_client.created), ['foo@1.service', 'foo@2.service', 'foo@3.service'])
+
+    def test_bulk_spawn_connection_per_thread(self):
+        backend = FakeFleetClient()
+        clients = list()
+
+        def factory(fleet_uri):
+            clients.append(ThreadBoundFleetClient(backend))
+            return clients[-1]
+
+        template = UnitTemplate('[Service]\nExecStart=/bin/true\n')
+        plan = Plan(ThreadLocalConnection('http://fleet', factory), 'foo', 'foo-new', template)
+        for i in range(1, 6):
+            plan.steps.append(Step('foo@%s.service' % i, 'spawn'))
+        plan.run()
+        self.assertEqual(len(backend.created), 5)
+        self.assertTrue(len(clients) > 1)
+
+        # a single client used by the workers is caught
+        plan = Plan(ThreadBoundFleetClient(backend), 'foo', 'foo-new', template)
+        plan.steps.append(Step('foo@6.service', 'spawn'))
+        plan.steps.append(Step('foo@7.service', 'spawn'))
+        with self.assertRaises(AssertionError):
+            plan.run()
+
+    def test_states_connection_per_thread(self):
+        backend = FakeFleetClient(running=['foo-old@1.service', 'foo-old@2.service', 'foo-old@3.service'])
+        connection = ThreadLocalConnection('http://fleet', lambda fleet_uri: ThreadBoundFleetClient(backend))
+        plan = Plan(connection, 'foo', 'foo-new', UnitTemplate(''))
+        plan.steps.append(Step('foo-old@1.service', 'destroy'))
+        plan.steps.append(Step('foo-old@2.service', 'destroy'))
+        plan.steps.append(Step('foo-old@3.service', 'stop'))
+        plan.run()
+        self.assertEqual(backend.running, set())
+        # each saved definition belongs to its own unit
+        self.assertEqual(sorted((s.name, s.template.options[0][2]) for s in plan.inverse_steps if s.action == 'spawn'),
+                         [('foo-old@1.service', '/bin/foo-old@1.service'),
+                          ('foo-old@2.service', '/bin/foo-old@2.service')])
+
+    def test_connection_failure_in_worker(self):
+        backend = FakeFleetClient()
+        clients = list()
+
+        def factory(fleet_uri):
+            if clients:
+                raise SystemExit('Unable to connect to Fleet')
+            clients.append(backend)
+            return backend
+
+        plan = Plan(ThreadLocalConnection('http://fleet', factory), 'foo', 'foo-new', UnitTemplate(''))
+        plan.steps.append(Step('foo@1.service', 'spawn'))
+        plan.steps.append(Step('foo@2.service', 'spawn'))
+        with self.assertRaises(Exception) as cm:
+            plan.run()
+        self.assertEqual(str(cm.exception), 'Unable to connect to Fleet')
+
+    def test_inverse_steps(self):
+        fleet_client = FakeFleetClient(running=['foo-old@1.service', 'foo-old@2.service'])
+        template = UnitTemplate('[Service]\nExecStart=/bin/true\n')
+        plan = Plan(fleet_client, 'foo', 'foo-new', template)
+        plan.steps.append(Step('foo-new@1.service', 'spawn'))
+        plan.steps.append(Step('foo-old@1.service', 'destroy'))
+        plan.steps.append(Step('foo-old@2.service', 'stop'))
+        plan.run()
+        self.assertEqual([str(s) for s in plan.inverse_steps],
+                         ['destroy foo-new@1.service', 'spawn foo-old@1.service', 'start foo-old@2.service'])
+        self.assertEqual(plan.inverse_steps[1].template.options, (('Service', 'ExecStart', '/bin/foo-old@1.service'),))
+
+        # a restarted unit needs no inverse
+        plan.steps.append(Step('foo-old@2.service', 'start'))
+        plan.execute(3)
+        self.assertEqual(len(plan.inverse_steps), 2)
+
+    def test_destroy_fails(self):
+        class FailingFleetClient(FakeFleetClient):
+            def destroy_unit(self, name):
+                raise Exception('destroy failed')
+
+        fleet_client = FailingFleetClient(running=['foo-old@1.service'])
+        plan = Plan(fleet_client, 'foo', 'foo-new', UnitTemplate(''))
+        plan.steps.append(Step('foo-old@1.service', 'destroy'))
+        with self.assertRaises(Exception):
+            plan.run()
+        # stopped but not destroyed, so restarted on rollback
+        self.assertEqual([str(s) for s in plan.inverse_steps], ['start foo-old@1.service'])
+
+        RollbackPlan.from_plans(fleet_client, [plan]).run()
+        self.assertEqual(fleet_client.running, set(['foo-old@1.service']))
+
+    def test_rollback(self):
+        fleet_client = FakeFleetClient(running=['foo-old@1.service'])
+        template = UnitTemplate('[Service]\nExecStart=/bin/true\n')
+        plan = Plan(fleet_client, 'foo', 'foo-new', template)
+        plan.steps.append(Step('foo-new@1.service', 'spawn'))
+        plan.steps.append(Step('foo-old@1.service', 'destroy'))
+        plan.run()
+        self.assertEqual(fleet_client.running, set(['foo-new@1.service']))
+
+        rollback = RollbackPlan.from_plans(fleet_client, [plan])
+        self.assertEqual([str(s) for s in rollback.steps], ['spawn foo-old@1.service', 'destroy foo-new@1.service'])
+
+        # survives a round trip through the rollback file
+        rollback = RollbackPlan.load(fleet_client, json.loads(json.dumps(rollback.dump())))
+        rollback.run()
+        self.assertEqual(fleet_client.running, set(['foo-old@1.service']))
+        self.assertEqual(fleet_client.created[-1], 'foo-old@1.service')
+
+    def test_probe(self):
+        fleet_client = FakeFleetClient(running=['foo@1.service'])
+        probe = FakeProbe()
+        plan = Plan(fleet_client, 'foo', 'foo-new', UnitTemplate(''), probe)
+        plan.steps.append(Step('foo@2.service', 'spawn'))
+        plan.steps.append(Step('foo@3.service', 'spawn'))
+        plan.steps.append(Step('foo@1.service', 'stop'))
+        plan.run()
+        self.assertEqual(sorted(probe.checks), ['foo@2.service 10.0.0.1', 'foo@2.service 10.0.0.1',
+                                                'foo@3.service 10.0.0.1', 'foo@3.service 10.0.0.1'])
+
+    def test_rolling_probe(self):
+        fleet_client = FakeFleetClient(running=['foo@1.service', 'foo@2.service'])
+        probe = FakeProbe()
+        plan = Plan(fleet_client, 'foo', 'foo-new', UnitTemplate(''), probe)
+        plan.steps.append(Step('foo@1.service', 'stop'))
+        plan.steps.append(Step('foo@2.service', 'stop'))
+        plan.steps.append(Step('foo@1.service', 'start'))
+        plan.steps.append(Step('foo@2.service', 'start'))
+
+        batches = list()
+        execute_concurrently = plan.execute_concurrently
+
+        def record(steps):
+            batches.append([str(step) for step in steps])
+            execute_concurrently(steps)
+
+        plan.execute_concurrently = record
+        plan.run()
+        self.assertEqual(batches, [['stop foo@1.service', 'stop foo@2.service'],
+                                   ['start foo@1.service', 'start foo@2.service']])
+        self.assertEqual(sorted(probe.checks), ['foo@1.service 10.0.0.1', 'foo@1.service 10.0.0.1',
+                                                'foo@2.service 10.0.0.1', 'foo@2.service 10.0.0.1'])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,63 @@
+import socket
+import sys
+import unittest
+
+from deploy import Probe
+
+
+class TestProbe(unittest.TestCase):
+
+    def test_target(self):
+        p = Probe('http://{ip}:80{instance}/health?unit={unit}')
+        self.assertEqual(p.target('foo-abc@1.service', '10.0.0.1'),
+                         'http://10.0.0.1:801/health?unit=foo-abc@1.service')
+
+    def test_tcp(self):
+        s = socket.socket()
+        s.bind(('127.0.0.1', 0))
+        s.listen(1)
+        port = s.getsockname()[1]
+        p = Probe('tcp://{ip}:%s' % port, timeout=1)
+        self.assertTrue(p.check('foo@1.service', '127.0.0.1'))
+        s.close()
+        self.assertFalse(p.check('foo@1.service', '127.0.0.1'))
+
+    def test_http_unreachable(self):
+        p = Probe('http://{ip}:1/', timeout=1)
+        self.assertFalse(p.check('foo@1.service', '127.0.0.1'))
+
+    def test_command(self):
+        self.assertTrue(Probe('true').check('foo@1.service', None))
+        self.assertFalse(Probe('false').check('foo@1.service', None))
+        self.assertFalse(Probe('does-not-exist-{unit}').check('foo@1.service', None))
+
+    def test_command_timeout(self):
+        p = Probe('sleep 5', timeout=0.1)
+        self.assertFalse(p.check('foo@1.service', None))
+
+    def test_command_output(self):
+        # more output than a pipe buffer holds
+        p = Probe('%s -c "print(\'x\' * 1000000)"' % sys.executable, timeout=5)
+        self.assertTrue(p.check('foo@1.service', None))
+
+    def test_deadline(self):
+        p = Probe('false', interval=0, deadline=0.2)
+        with self.assertRaises(Exception):
+            p.wait('foo@1.service', None)
+
+    def test_invalid_spec(self):
+        for spec in ("awk '{print $1}'", '{}', '{"ok": true}', '{foo}'):
+            with self.assertRaises(ValueError):
+                Probe(spec)
+        self.assertEqual(Probe("awk '{{print $1}}' {unit}").target('foo@1.service', None), "awk '{print $1}' foo@1.service")
+
+    def test_missing_ip(self):
+        p = Probe('tcp://{ip}:80', interval=0)
+        self.assertFalse(p.check('foo@1.service', None))
+        with self.assertRaises(Exception):
+            p.wait('foo@1.service', None)
+        # the ip is not needed here
+        self.assertTrue(Probe('true').check('foo@1.service', None))
+
+if __name__ == '__main__':
+    unittest.main()
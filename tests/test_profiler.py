@@ -0,0 +1,91 @@
+import os
+import pstats
+import tempfile
+import unittest
+
+import deploy
+from deploy import Plan, Profiler
+
+
+def worker(n):
+    return sum(range(n))
+
+
+class TestProfiler(unittest.TestCase):
+
+    def test_phases(self):
+        p = Profiler(True, exclude=('delay',))
+        p.add('import', 0.5, 0.25)
+        with p.phase('load'):
+            sum(range(1000))
+        with p.phase('delay'):
+            pass
+        self.assertEqual([t[0] for t in p.timings], ['import', 'load'])
+
+        summary = p.summary()
+        self.assertEqual(summary[0], '==> Profile')
+        self.assertEqual(summary[2], 'import          0.500      0.250')
+        self.assertTrue(summary[-1].startswith('total'))
+
+    def test_dump(self):
+        p = Profiler(True)
+        with p.phase('plan'):
+            sum(range(1000))
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            p.dump(path)
+            self.assertTrue(pstats.Stats(path).total_calls > 0)
+        finally:
+            os.remove(path)
+
+    def test_workers(self):
+        p = Profiler(True)
+        with p.phase('run'):
+            Plan.map_concurrently(worker, [1000, 2000])
+        Plan.map_concurrently(worker, [3000])  # outside any phase
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            p.dump(path)
+            calls = [(f[2], s[0]) for f, s in pstats.Stats(path).stats.items() if f[2] == 'worker']
+            self.assertEqual(calls, [('worker', 2)])
+        finally:
+            os.remove(path)
+
+    def test_enable_fails(self):
+        class BusyProfile(object):
+            def enable(self):
+                raise ValueError('Another profiling tool is already active')
+
+        p = Profiler(True)
+        p.profile = BusyProfile()
+        with p.phase('run'):
+            self.assertIsNone(Profiler.current)
+        self.assertEqual([t[0] for t in p.timings], ['run'])
+
+        profile = deploy.cProfile.Profile
+        deploy.cProfile.Profile = BusyProfile
+        Profiler.current = Profiler(True)
+        try:
+            self.assertEqual(Profiler.profiled(worker)(10), 45)
+        finally:
+            deploy.cProfile.Profile = profile
+            Profiler.current = None
+
+    def test_nothing_profiled(self):
+        p = Profiler(True, exclude=Profiler.phases)
+        with p.phase('run'):
+            pass
+        self.assertFalse(p.dump(os.path.join(tempfile.gettempdir(), 'never-written.prof')))
+        self.assertFalse(os.path.exists(os.path.join(tempfile.gettempdir(), 'never-written.prof')))
+
+    def test_disabled(self):
+        p = Profiler()
+        p.add('import', 0.5, 0.25)
+        with p.phase('load'):
+            pass
+        self.assertEqual(p.timings, [])
+
+if __name__ == '__main__':
+    unittest.main()
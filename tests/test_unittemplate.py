@@ -0,0 +1,42 @@
+import unittest
+
+import fleet.v1 as fleet
+
+from deploy import UnitTemplate
+
+TEMPLATE = """[Unit]
+Description=Foo
+
+[Service]
+ExecStart=/usr/bin/foo
+"""
+
+
+class TestUnitTemplate(unittest.TestCase):
+
+    def test_parse_string(self):
+        t = UnitTemplate(TEMPLATE)
+        self.assertEqual(t.options, (('Unit', 'Description', 'Foo'), ('Service', 'ExecStart', '/usr/bin/foo')))
+
+    def test_parse_fleet_unit(self):
+        t = UnitTemplate(fleet.Unit(from_string=TEMPLATE))
+        self.assertEqual(t.options, UnitTemplate(TEMPLATE).options)
+
+    def test_parsed_once(self):
+        t = UnitTemplate(TEMPLATE)
+        self.assertIs(t.options, t.options)
+
+    def test_to_unit(self):
+        t = UnitTemplate(TEMPLATE)
+        a = t.to_unit()
+        b = t.to_unit()
+        self.assertIsNot(a, b)
+        self.assertEqual(a.options, b.options)
+        self.assertEqual(a.options[1], {'section': 'Service', 'name': 'ExecStart', 'value': '/usr/bin/foo'})
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            UnitTemplate('not a unit file').options
+
+if __name__ == '__main__':
+    unittest.main()